@@ -17,6 +17,8 @@ Selector types: "attributeValueSelector", "tagContainsSelector", "xpathSelector"
 
 from __future__ import annotations
 
+import re
+from functools import lru_cache
 from typing import Any, Dict, Optional
 
 from loguru import logger
@@ -54,14 +56,27 @@ def navigate_action(url: str) -> Dict[str, Any]:
     return {"type": "NavigateAction", "url": url}
 
 
+# Fixed-shape actions are returned as shared prototypes rather than rebuilt
+# per step. They stay plain dicts so FastAPI can serialize them; read-only.
+_SCROLL_DOWN: Dict[str, Any] = {
+    "type": "ScrollAction",
+    "down": True,
+    "up": False,
+    "left": False,
+    "right": False,
+}
+_SCROLL_UP: Dict[str, Any] = {
+    "type": "ScrollAction",
+    "down": False,
+    "up": True,
+    "left": False,
+    "right": False,
+}
+_IDLE: Dict[str, Any] = {"type": "IdleAction"}
+
+
 def scroll_action(*, down: bool = True) -> Dict[str, Any]:
-    return {
-        "type": "ScrollAction",
-        "down": down,
-        "up": not down,
-        "left": False,
-        "right": False,
-    }
+    return _SCROLL_DOWN if down else _SCROLL_UP
 
 
 def wait_action(seconds: float = 1.0) -> Dict[str, Any]:
@@ -70,7 +85,7 @@ def wait_action(seconds: float = 1.0) -> Dict[str, Any]:
 
 def idle_action() -> Dict[str, Any]:
     """IWA IdleAction - used when the task appears complete (no DoneAction in IWA)."""
-    return {"type": "IdleAction"}
+    return _IDLE
 
 
 def submit_action(selector: Dict[str, Any]) -> Dict[str, Any]:
@@ -81,6 +96,21 @@ def hover_action(selector: Dict[str, Any]) -> Dict[str, Any]:
     return {"type": "HoverAction", "selector": selector}
 
 
+def resolve_candidate_id(raw: Any, count: int) -> Optional[int]:
+    """Return the LLM's candidate_id as a valid index below `count`, else None.
+
+    Accepts ints and numeric strings (models sometimes quote the id).
+    """
+    if isinstance(raw, str):
+        try:
+            raw = int(raw)
+        except ValueError:
+            return None
+    if isinstance(raw, int) and 0 <= raw < count:
+        return raw
+    return None
+
+
 def _normalize_action_name(raw: str) -> str:
     """Normalize an action name from LLM output to a canonical form.
 
@@ -90,11 +120,11 @@ def _normalize_action_name(raw: str) -> str:
       "scroll" -> "scroll"
       "type" -> "type"
     """
-    name = raw.lower().strip()
-    # Remove trailing "action" suffix if present
+    name = raw.strip().lower()
+    # Remove trailing "action" suffix if present (and any space before it)
     if name.endswith("action"):
-        name = name[:-6]
-    return name.strip()
+        name = name[:-6].rstrip()
+    return name
 
 
 # Map of normalized action names to canonical action type
@@ -124,83 +154,153 @@ _ACTION_ALIASES = {
     "hover": "hover",
 }
 
+# Finds aliases embedded in a longer name (e.g. "clickbutton"); longest first
+_ALIAS_RE = re.compile(
+    "|".join(re.escape(alias) for alias in sorted(_ACTION_ALIASES, key=len, reverse=True))
+)
+
+
+def _build_alias_fragments() -> Dict[str, str]:
+    """Map every substring of an alias to the first alias (in table order) containing it.
+
+    Covers truncated names such as "nav" or "sel".
+    """
+    fragments: Dict[str, str] = {}
+    for alias, canonical in _ACTION_ALIASES.items():
+        for i in range(len(alias)):
+            for j in range(i + 1, len(alias) + 1):
+                fragments.setdefault(alias[i:j], canonical)
+    return fragments
+
+
+_ALIAS_FRAGMENTS = _build_alias_fragments()
+
+
+def _match_action_alias(normalized: str) -> Optional[str]:
+    """Resolve a name that is not an exact alias via substring matching."""
+    matches = _ALIAS_RE.findall(normalized)
+    if matches:
+        return _ACTION_ALIASES[max(matches, key=len)]
+    return _ALIAS_FRAGMENTS.get(normalized)
 
-def build_action_from_llm(decision: Dict[str, Any], candidates: list) -> Optional[Dict[str, Any]]:
-    """Convert LLM decision dict into a proper IWA action."""
-    raw_action = decision.get("action", decision.get("type", ""))
-    if not raw_action:
-        return None
 
-    normalized = _normalize_action_name(str(raw_action))
+@lru_cache(maxsize=256)
+def _resolve_action(raw: str) -> Optional[str]:
+    """Map a raw LLM action name to its canonical action, or None if unknown.
+
+    Memoized on the raw string: models emit only a handful of spellings, so
+    normalization and partial matching run once per distinct spelling.
+    """
+    normalized = _normalize_action_name(raw)
     action = _ACTION_ALIASES.get(normalized)
 
     # If not found in aliases, try partial matching
     if action is None:
-        for alias, canonical in _ACTION_ALIASES.items():
-            if alias in normalized or normalized in alias:
-                action = canonical
-                break
+        action = _match_action_alias(normalized)
+    return action
 
+
+def build_action_from_llm(decision: Dict[str, Any], candidates: list) -> Optional[Dict[str, Any]]:
+    """Convert LLM decision dict into a proper IWA action."""
+    raw_action = decision.get("action", decision.get("type", ""))
+    if not raw_action:
+        return None
+
+    action = _resolve_action(str(raw_action))
     if action is None:
+        normalized = _normalize_action_name(str(raw_action))
         logger.warning(f"Unknown action type: {raw_action!r} (normalized: {normalized!r})")
         return None
 
-    candidate_id = decision.get("candidate_id")
-
-    # Also accept candidate_id as string
-    if isinstance(candidate_id, str):
-        try:
-            candidate_id = int(candidate_id)
-        except ValueError:
-            candidate_id = None
-
     # Resolve selector from candidate list
     selector = None
-    if candidate_id is not None and isinstance(candidate_id, int) and 0 <= candidate_id < len(candidates):
+    candidate_id = resolve_candidate_id(decision.get("candidate_id"), len(candidates))
+    if candidate_id is not None:
         selector = candidates[candidate_id].get("selector")
 
-    if action == "click":
-        if selector:
-            return click_action(selector)
-        # If LLM specified a selector directly in the decision
-        if "selector" in decision and isinstance(decision["selector"], dict):
-            return click_action(decision["selector"])
-    elif action == "type":
-        text = decision.get("text", decision.get("value", ""))
-        if selector:
-            # Allow typing empty string (to clear a field)
-            return type_action(selector, str(text))
-    elif action == "select":
-        text = decision.get("text", decision.get("option", decision.get("value", "")))
-        if selector and text:
-            return select_option_action(selector, str(text))
-    elif action == "navigate":
-        url = decision.get("url", "")
-        if url:
-            # Only allow http/https schemes to prevent file:// or javascript: injection
-            scheme = url.split("://")[0].lower() if "://" in url else ""
-            if scheme in ("http", "https", ""):
-                return navigate_action(url)
-            else:
-                return None
-    elif action in ("scroll", "scroll_down", "scroll_up"):
-        direction = decision.get("direction", "down").lower()
-        if action == "scroll_up" or direction == "up":
-            return scroll_action(down=False)
-        return scroll_action(down=True)
-    elif action == "wait":
-        try:
-            seconds = float(decision.get("seconds", decision.get("time", decision.get("time_seconds", 1.0))))
-        except (ValueError, TypeError):
-            seconds = 1.0
-        return wait_action(seconds)
-    elif action == "idle":
-        return idle_action()
-    elif action == "submit":
-        if selector:
-            return submit_action(selector)
-    elif action == "hover":
-        if selector:
-            return hover_action(selector)
+    handler = _HANDLERS.get(action)
+    return handler(decision, selector) if handler else None
+
+
+# --- Action handlers ---
+# Each takes (decision, resolved candidate selector or None) and returns the
+# IWA action dict, or None if the decision lacks what the action needs.
+
 
+def _handle_click(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    if selector:
+        return click_action(selector)
+    # If LLM specified a selector directly in the decision
+    if "selector" in decision and isinstance(decision["selector"], dict):
+        return click_action(decision["selector"])
     return None
+
+
+def _handle_type(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    text = decision.get("text", decision.get("value", ""))
+    if selector:
+        # Allow typing empty string (to clear a field)
+        return type_action(selector, str(text))
+    return None
+
+
+def _handle_select(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    text = decision.get("text", decision.get("option", decision.get("value", "")))
+    if selector and text:
+        return select_option_action(selector, str(text))
+    return None
+
+
+def _handle_navigate(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    url = decision.get("url", "")
+    if url:
+        # Only allow http/https schemes to prevent file:// or javascript: injection
+        scheme = url.split("://")[0].lower() if "://" in url else ""
+        if scheme in ("http", "https", ""):
+            return navigate_action(url)
+    return None
+
+
+def _handle_scroll(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    direction = decision.get("direction", "down").lower()
+    return scroll_action(down=direction != "up")
+
+
+def _handle_scroll_up(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return scroll_action(down=False)
+
+
+def _handle_wait(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    try:
+        seconds = float(decision.get("seconds", decision.get("time", decision.get("time_seconds", 1.0))))
+    except (ValueError, TypeError):
+        seconds = 1.0
+    return wait_action(seconds)
+
+
+def _handle_idle(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return idle_action()
+
+
+def _handle_submit(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return submit_action(selector) if selector else None
+
+
+def _handle_hover(decision: Dict[str, Any], selector: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    return hover_action(selector) if selector else None
+
+
+# Canonical action name (values of _ACTION_ALIASES) -> handler
+_HANDLERS = {
+    "click": _handle_click,
+    "type": _handle_type,
+    "select": _handle_select,
+    "navigate": _handle_navigate,
+    "scroll": _handle_scroll,
+    "scroll_down": _handle_scroll,  # an explicit "direction" still wins
+    "scroll_up": _handle_scroll_up,
+    "wait": _handle_wait,
+    "idle": _handle_idle,
+    "submit": _handle_submit,
+    "hover": _handle_hover,
+}
@@ -11,22 +11,61 @@ from __future__ import annotations
 from dotenv import load_dotenv
 load_dotenv()
 
+import asyncio
+import hashlib
 import os
-from typing import Any, Dict
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Tuple
 
 from fastapi import Body, FastAPI
 from loguru import logger
 
-from actions import build_action_from_llm, click_action, scroll_action
-from html_parser import format_candidates_for_prompt, parse_html, build_page_summary
-from llm_client import get_action_decision
-from prompts import SYSTEM_PROMPT, build_user_prompt
+from actions import build_action_from_llm, click_action, resolve_candidate_id, scroll_action
+from html_parser import analyze_html, format_candidates_for_prompt
+from llm_client import aclose_client, get_action_decision, warmup
+from prompts import build_messages
 
-app = FastAPI(title="SN36 Web Agent", version="1.0.0")
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Connect to the LLM gateway before the first step pays the handshake
+    await warmup()
+    yield
+    # Release pooled LLM gateway connections
+    await aclose_client()
+
+
+app = FastAPI(title="SN36 Web Agent", version="1.0.0", lifespan=_lifespan)
 
 # Optional metrics
 _RETURN_METRICS = os.getenv("AGENT_RETURN_METRICS", "0") == "1"
 
+# Parsed snapshots keyed by a digest of the HTML. Consecutive steps of a task
+# often see an unchanged DOM, so this skips the lxml parse entirely on a hit.
+# Keyed by digest (not the HTML itself) so the cache never pins large snapshots.
+_PARSE_CACHE_SIZE = 64
+_PARSE_CACHE: OrderedDict[bytes, Tuple[List[Dict[str, Any]], str]] = OrderedDict()
+
+# HTML parsing is CPU-bound; run it off the event loop so concurrent /act
+# requests are not serialized behind one another's parse.
+try:
+    _PARSE_WORKERS: int = int(os.getenv("AGENT_PARSE_WORKERS", "0"))
+except ValueError:
+    _PARSE_WORKERS = 0
+_PARSE_POOL = ThreadPoolExecutor(
+    max_workers=_PARSE_WORKERS if _PARSE_WORKERS > 0 else os.cpu_count(),
+    thread_name_prefix="html-parse",
+)
+
+# Optional exact-match decision cache: (prompt, url, snapshot digest, model)
+# -> action. Off by default since repeating an action on an unchanged page
+# is not always what the task needs; enable with AGENT_DECISION_CACHE=1.
+_DECISION_CACHE_ENABLED = os.getenv("AGENT_DECISION_CACHE", "0") == "1"
+_DECISION_CACHE_SIZE = 100
+_DECISION_CACHE: OrderedDict[Tuple[str, str, bytes, str], Dict[str, Any]] = OrderedDict()
+
 
 @app.get("/health", summary="Health check")
 async def health() -> Dict[str, str]:
@@ -110,17 +149,25 @@ async def _decide_action(
 ) -> Dict[str, Any]:
     """Parse HTML, build prompt, call LLM, return IWA action."""
 
-    # 1. Parse HTML to extract interactive elements
-    candidates = parse_html(snapshot_html)
+    snapshot_html = snapshot_html or ""
+    digest = hashlib.blake2b(snapshot_html.encode(), digest_size=16).digest()
+
+    decision_key = (prompt, url, digest, model or "")
+    if _DECISION_CACHE_ENABLED:
+        cached_action = _DECISION_CACHE.get(decision_key)
+        if cached_action is not None:
+            _DECISION_CACHE.move_to_end(decision_key)
+            logger.info(f"[{task_id}] Action (cached): {cached_action.get('type', 'unknown')}")
+            return cached_action
 
-    # 2. Build page summary
-    page_summary = build_page_summary(snapshot_html)
+    # 1-2. Parse HTML to extract interactive elements and a page summary
+    candidates, page_summary = await _parse_snapshot(snapshot_html, digest)
 
     # 3. Format candidates for prompt
     candidates_text = format_candidates_for_prompt(candidates)
 
     # 4. Build messages
-    user_prompt = build_user_prompt(
+    messages = build_messages(
         task=prompt,
         url=url,
         page_summary=page_summary,
@@ -129,11 +176,6 @@ async def _decide_action(
         step_index=step_index,
     )
 
-    messages = [
-        {"role": "system", "content": SYSTEM_PROMPT},
-        {"role": "user", "content": user_prompt},
-    ]
-
     # 5. Call LLM
     decision = await get_action_decision(
         messages=messages,
@@ -148,19 +190,38 @@ async def _decide_action(
     # 6. Convert LLM decision to IWA action
     action = build_action_from_llm(decision, candidates)
 
+    if action and _DECISION_CACHE_ENABLED:
+        _DECISION_CACHE[decision_key] = action
+        if len(_DECISION_CACHE) > _DECISION_CACHE_SIZE:
+            _DECISION_CACHE.popitem(last=False)
+
     if not action:
         logger.warning(f"[{task_id}] Could not build action from: {decision}")
         # If LLM gave a candidate_id but action failed, try click as fallback
-        cid = decision.get("candidate_id")
-        if isinstance(cid, str):
-            try:
-                cid = int(cid)
-            except ValueError:
-                cid = None
-        if cid is not None and isinstance(cid, int) and 0 <= cid < len(candidates):
+        cid = resolve_candidate_id(decision.get("candidate_id"), len(candidates))
+        if cid is not None:
             action = click_action(candidates[cid]["selector"])
         else:
             action = scroll_action(down=True)
 
     logger.info(f"[{task_id}] Action: {action.get('type', 'unknown')}")
     return action
+
+
+async def _parse_snapshot(snapshot_html: str, key: bytes) -> Tuple[List[Dict[str, Any]], str]:
+    """Return (candidates, page_summary) for a snapshot, memoized by its digest `key`.
+
+    Misses are parsed on _PARSE_POOL; the cache itself is only touched from the
+    event loop. The cached candidate list is shared and must not be mutated.
+    """
+    cached = _PARSE_CACHE.get(key)
+    if cached is not None:
+        _PARSE_CACHE.move_to_end(key)
+        return cached
+
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(_PARSE_POOL, analyze_html, snapshot_html)
+    _PARSE_CACHE[key] = result
+    if len(_PARSE_CACHE) > _PARSE_CACHE_SIZE:
+        _PARSE_CACHE.popitem(last=False)
+    return result
@@ -6,8 +6,14 @@ selects, textareas) and builds a compact representation for the LLM prompt.
 
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
-from bs4 import BeautifulSoup, Tag
+import re
+import threading
+from html.parser import HTMLParser as _StdlibHTMLParser
+from itertools import chain, islice
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from lxml import etree
+from lxml.html import HtmlElement, HTMLParser, document_fromstring
 
 from actions import make_selector
 
@@ -16,9 +22,67 @@ from actions import make_selector
 _INTERACTIVE_TAGS = {"a", "button", "input", "textarea", "select"}
 _CLICKABLE_ROLES = {"button", "link", "tab", "menuitem", "checkbox", "radio", "switch"}
 
+# (tag, type) -> sort priority; ("tag", "") is the fallback for any type.
+# Form fields first, then submit buttons, buttons, toggles, links; others get 40.
+_PRIORITY: Dict[Tuple[str, str], int] = {
+    **{("input", t): 10 for t in ("text", "email", "password", "search", "tel", "url")},
+    ("textarea", ""): 11,
+    ("select", ""): 12,
+    ("input", "submit"): 15,
+    ("button", ""): 20,
+    ("input", "checkbox"): 25,
+    ("input", "radio"): 25,
+    ("a", ""): 30,
+}
+
 # Maximum candidates to send to LLM (keep prompt small for speed)
 MAX_CANDIDATES = 40
 
+# Snapshots larger than this have script/style/svg/noscript blocks removed as
+# text before parsing; only past MAX_HTML_CHARS is the remainder cut. The cut
+# is a last-resort bound: forms and dialogs often sit at the end of <body>.
+_STRIP_BLOCKS_CHARS = 512_000
+MAX_HTML_CHARS = 8_000_000
+_BLOCK_OPEN_RE = re.compile(r"<(script|style|svg|noscript)\b", re.IGNORECASE)
+_BLOCK_CLOSE_RES = {
+    tag: re.compile(rf"</{tag}\s*>", re.IGNORECASE) for tag in ("script", "style", "svg", "noscript")
+}
+
+# Attributes copied onto each candidate (values truncated to 100 chars)
+_CANDIDATE_ATTRS = ("name", "placeholder", "href", "value", "aria-label", "title")
+
+# One-pass XPath selecting every element that may become a candidate
+_CANDIDATE_XPATH = etree.XPath(
+    "//*[self::a or self::button or self::input or self::textarea or self::select"
+    " or @role or @onclick]"
+)
+
+# Elements stripped before extraction (never visible / never interactive)
+_NON_CONTENT_TAGS = ("script", "style", "noscript", "svg", "path")
+
+# Snapshots are fed as UTF-8 bytes so documents carrying an XML encoding
+# declaration parse the same as any other page. huge_tree lifts libxml2's
+# ~255-level nesting limit, past which deeply nested SPA markup is silently
+# dropped. lxml locks a parser for the duration of a parse, so each thread
+# gets its own (see _get_parser).
+_PARSER_LOCAL = threading.local()
+
+
+def analyze_html(html: str) -> Tuple[List[Dict[str, Any]], str]:
+    """Parse HTML once and return (candidates, page_summary).
+
+    Equivalent to calling parse_html() and build_page_summary() separately,
+    but shares a single parse and cleanup pass between the two.
+    """
+    if not html:
+        return [], "Empty page."
+
+    root = _make_tree(html)
+    if root is None:
+        return [], "Page with interactive elements."
+    label_map = _build_label_map(root)
+    return _parse_html_from_tree(root, label_map), _build_page_summary_from_tree(root, label_map)
+
 
 def parse_html(html: str) -> List[Dict[str, Any]]:
     """Extract interactive elements from HTML and return candidate list.
@@ -35,49 +99,10 @@ def parse_html(html: str) -> List[Dict[str, Any]]:
     if not html or not html.strip():
         return []
 
-    soup = BeautifulSoup(html, "lxml")
-
-    # Remove script, style, and hidden elements
-    for tag in soup.find_all(["script", "style", "noscript", "svg", "path"]):
-        tag.decompose()
-
-    candidates: List[Dict[str, Any]] = []
-    seen_selectors: set = set()
-
-    # 1. Collect explicitly interactive elements
-    for element in soup.find_all(_INTERACTIVE_TAGS):
-        candidate = _extract_candidate(element)
-        if candidate and candidate["_key"] not in seen_selectors:
-            seen_selectors.add(candidate["_key"])
-            candidates.append(candidate)
-
-    # 2. Collect elements with interactive roles
-    for element in soup.find_all(attrs={"role": True}):
-        role = element.get("role", "").lower()
-        if role in _CLICKABLE_ROLES:
-            candidate = _extract_candidate(element)
-            if candidate and candidate["_key"] not in seen_selectors:
-                seen_selectors.add(candidate["_key"])
-                candidates.append(candidate)
-
-    # 3. Collect clickable elements (onclick, tabindex, contenteditable)
-    for element in soup.find_all(attrs={"onclick": True}):
-        candidate = _extract_candidate(element)
-        if candidate and candidate["_key"] not in seen_selectors:
-            seen_selectors.add(candidate["_key"])
-            candidates.append(candidate)
-
-    # Prioritize: form inputs first, then buttons, then links
-    candidates.sort(key=_candidate_priority)
-
-    # Trim to max and assign sequential IDs
-    candidates = candidates[:MAX_CANDIDATES]
-    for i, c in enumerate(candidates):
-        c["id"] = i
-        c.pop("_key", None)
-        c.pop("_priority", None)
-
-    return candidates
+    root = _make_tree(html)
+    if root is None:
+        return []
+    return _parse_html_from_tree(root, _build_label_map(root))
 
 
 def build_page_summary(html: str) -> str:
@@ -85,41 +110,10 @@ def build_page_summary(html: str) -> str:
     if not html:
         return "Empty page."
 
-    soup = BeautifulSoup(html, "lxml")
-    for tag in soup.find_all(["script", "style", "noscript"]):
-        tag.decompose()
-
-    # Get title
-    title = ""
-    title_tag = soup.find("title")
-    if title_tag:
-        title = title_tag.get_text(strip=True)
-
-    # Get headings
-    headings = []
-    for h in soup.find_all(["h1", "h2", "h3"], limit=5):
-        text = h.get_text(strip=True)[:80]
-        if text:
-            headings.append(f"  {h.name}: {text}")
-
-    # Get forms
-    forms = []
-    for form in soup.find_all("form", limit=3):
-        inputs = form.find_all(["input", "textarea", "select"])
-        labels = [_get_input_label(inp) for inp in inputs[:5]]
-        labels = [l for l in labels if l]
-        if labels:
-            forms.append(f"  Form fields: {', '.join(labels)}")
-
-    parts = []
-    if title:
-        parts.append(f"Page: {title}")
-    if headings:
-        parts.append("Headings:\n" + "\n".join(headings))
-    if forms:
-        parts.append("Forms:\n" + "\n".join(forms))
-
-    return "\n".join(parts) if parts else "Page with interactive elements."
+    root = _make_tree(html)
+    if root is None:
+        return "Page with interactive elements."
+    return _build_page_summary_from_tree(root, _build_label_map(root))
 
 
 def format_candidates_for_prompt(candidates: List[Dict[str, Any]]) -> str:
@@ -179,39 +173,240 @@ def format_candidates_for_prompt(candidates: List[Dict[str, Any]]) -> str:
 # --- Internal helpers ---
 
 
-def _extract_candidate(element: Tag) -> Optional[Dict[str, Any]]:
-    """Extract a candidate dict from a BeautifulSoup element."""
-    tag = element.name
-    if not tag:
+def _make_tree(html: str) -> Optional[HtmlElement]:
+    """Parse HTML and drop non-content elements (scripts, styles, inline SVG).
+
+    Returns None when lxml finds no document at all (e.g. only a comment).
+    """
+    if len(html) > _STRIP_BLOCKS_CHARS:
+        html = _trim_html(html)
+    parser = _get_parser()
+    try:
+        root = document_fromstring(html.encode("utf-8", "replace"), parser=parser)
+    except etree.ParserError:
+        return None
+    if any(e.type_name == "ERR_RESOURCE_LIMIT" for e in parser.error_log):
+        # libxml2 caps nesting depth even with huge_tree and silently drops
+        # everything below the cap; rebuild from the stdlib tokenizer instead
+        root = _DeepTreeBuilder.build(html)
+    etree.strip_elements(root, *_NON_CONTENT_TAGS, with_tail=False)
+    return root
+
+
+def _get_parser() -> HTMLParser:
+    """Return this thread's parser, so pool workers can parse concurrently."""
+    parser = getattr(_PARSER_LOCAL, "parser", None)
+    if parser is None:
+        parser = HTMLParser(
+            encoding="utf-8", remove_comments=True, remove_pis=True, huge_tree=True
+        )
+        _PARSER_LOCAL.parser = parser
+    return parser
+
+
+class _DeepTreeBuilder(_StdlibHTMLParser):
+    """Fallback tree builder without a nesting limit (stdlib tokenizer).
+
+    Only used for documents past libxml2's depth cap. Unmatched end tags are
+    ignored and open elements are closed implicitly, roughly like a browser.
+    """
+
+    _VOID = frozenset((
+        "area", "base", "br", "col", "embed", "hr", "img", "input",
+        "link", "meta", "param", "source", "track", "wbr",
+    ))
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self._builder = etree.TreeBuilder(parser=_get_parser())
+        self._builder.start("html", {})
+        self._stack: List[str] = ["html"]
+
+    @classmethod
+    def build(cls, html: str) -> HtmlElement:
+        builder = cls()
+        builder.feed(html)
+        builder.close()
+        for tag in reversed(builder._stack):
+            builder._builder.end(tag)
+        return builder._builder.close()
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag == "html":
+            return
+        try:
+            self._builder.start(tag, {k: v or "" for k, v in attrs})
+        except ValueError:
+            # lxml rejects some names browsers accept; keep the element if we can
+            try:
+                self._builder.start(tag, {})
+            except ValueError:
+                return
+        if tag in self._VOID:
+            self._builder.end(tag)
+        else:
+            self._stack.append(tag)
+
+    def handle_startendtag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        self.handle_starttag(tag, attrs)
+        if tag not in self._VOID and self._stack[-1] == tag and len(self._stack) > 1:
+            self._builder.end(self._stack.pop())
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "html" or tag not in self._stack:
+            return
+        while True:
+            open_tag = self._stack.pop()
+            self._builder.end(open_tag)
+            if open_tag == tag:
+                return
+
+    def handle_data(self, data: str) -> None:
+        self._builder.data(data)
+
+
+def _trim_html(html: str) -> str:
+    """Bound snapshot size: drop script/style/svg/noscript blocks, then cut.
+
+    Inline scripts and SVG dominate many SPA snapshots, so removing them first
+    usually brings the page under MAX_HTML_CHARS. The scan is linear: it stops
+    at the first opener with no closing tag and leaves the rest to lxml.
+    """
+    parts: List[str] = []
+    pos = 0
+    while True:
+        opener = _BLOCK_OPEN_RE.search(html, pos)
+        if opener is None:
+            break
+        closer = _BLOCK_CLOSE_RES[opener.group(1).lower()].search(html, opener.end())
+        if closer is None:
+            break
+        parts.append(html[pos:opener.start()])
+        pos = closer.end()
+    if parts:
+        parts.append(html[pos:])
+        html = "".join(parts)
+
+    if len(html) <= MAX_HTML_CHARS:
+        return html
+    cut = html.rfind("<", 0, MAX_HTML_CHARS)
+    return html[:cut if cut > 0 else MAX_HTML_CHARS]
+
+
+def _build_label_map(root: HtmlElement) -> Dict[str, str]:
+    """Index label text by the label's "for" attribute (first label wins)."""
+    label_map: Dict[str, str] = {}
+    for label in root.iter("label"):
+        target = label.get("for")
+        if target and target not in label_map:
+            label_map[target] = _get_text(label)
+    return label_map
+
+
+def _parse_html_from_tree(root: HtmlElement, label_map: Dict[str, str]) -> List[Dict[str, Any]]:
+    """Extract the candidate list from an already cleaned tree."""
+    candidates: List[Dict[str, Any]] = []
+    seen_selectors: Set[Tuple[str, str, str]] = set()
+
+    # Single tree walk; matches are bucketed so candidates keep the original
+    # precedence: 1. interactive tags, 2. clickable roles, 3. onclick handlers
+    interactive: List[HtmlElement] = []
+    with_role: List[HtmlElement] = []
+    with_onclick: List[HtmlElement] = []
+    for element in _CANDIDATE_XPATH(root):
+        if element.tag in _INTERACTIVE_TAGS:
+            interactive.append(element)
+        elif element.get("role", "").lower() in _CLICKABLE_ROLES:
+            with_role.append(element)
+        elif element.get("onclick") is not None:
+            with_onclick.append(element)
+
+    for element in chain(interactive, with_role, with_onclick):
+        candidate = _extract_candidate(element, label_map)
+        if candidate and candidate["_key"] not in seen_selectors:
+            seen_selectors.add(candidate["_key"])
+            candidates.append(candidate)
+
+    # Prioritize: form inputs first, then buttons, then links
+    candidates.sort(key=_candidate_priority)
+
+    # Trim to max and assign sequential IDs
+    candidates = candidates[:MAX_CANDIDATES]
+    for i, c in enumerate(candidates):
+        c["id"] = i
+        c.pop("_key", None)
+        c.pop("_priority", None)
+
+    return candidates
+
+
+def _build_page_summary_from_tree(root: HtmlElement, label_map: Dict[str, str]) -> str:
+    """Build the page summary from an already cleaned tree."""
+    # Get title
+    title = ""
+    title_tag = root.find(".//title")
+    if title_tag is not None:
+        title = _get_text(title_tag)
+
+    # Get headings
+    headings = []
+    for h in islice(root.iter("h1", "h2", "h3"), 5):
+        text = _get_text(h)[:80]
+        if text:
+            headings.append(f"  {h.tag}: {text}")
+
+    # Get forms
+    forms = []
+    for form in islice(root.iter("form"), 3):
+        inputs = islice(form.iter("input", "textarea", "select"), 5)
+        labels = [_get_input_label(inp, label_map) for inp in inputs]
+        labels = [l for l in labels if l]
+        if labels:
+            forms.append(f"  Form fields: {', '.join(labels)}")
+
+    parts = []
+    if title:
+        parts.append(f"Page: {title}")
+    if headings:
+        parts.append("Headings:\n" + "\n".join(headings))
+    if forms:
+        parts.append("Forms:\n" + "\n".join(forms))
+
+    return "\n".join(parts) if parts else "Page with interactive elements."
+
+
+def _extract_candidate(element: HtmlElement, label_map: Dict[str, str]) -> Optional[Dict[str, Any]]:
+    """Extract a candidate dict from an lxml element."""
+    tag = element.tag
+    if not isinstance(tag, str):
         return None
 
-    text = _get_visible_text(element)
-    elem_type = element.get("type", "")
-    if isinstance(elem_type, list):
-        elem_type = elem_type[0] if elem_type else ""
+    # Read all attributes once; plain dict lookups from here on
+    attrs = dict(element.attrib)
+    elem_type = attrs.get("type", "")
 
     # Skip hidden/disabled inputs
-    if tag == "input" and elem_type in ("hidden",):
+    if tag == "input" and elem_type == "hidden":
         return None
-    if element.get("disabled") is not None:
+    if "disabled" in attrs:
         return None
-    if element.get("aria-hidden") == "true":
+    if attrs.get("aria-hidden") == "true":
         return None
     # Skip standalone options (handled as part of select)
     if tag == "option":
         return None
 
+    text = _get_visible_text(element, attrs)
+
     # Build selector - prefer id, then name, then text content
-    selector = _build_selector(element)
+    selector = _build_selector(tag, attrs, text)
     if not selector:
         return None
 
     # Get relevant attributes
-    attributes: Dict[str, str] = {}
-    for attr in ("name", "placeholder", "href", "value", "aria-label", "title"):
-        val = element.get(attr)
-        if val and isinstance(val, str):
-            attributes[attr] = val[:100]
+    attributes: Dict[str, str] = {
+        attr: val[:100] for attr in _CANDIDATE_ATTRS if (val := attrs.get(attr))
+    }
 
     # Get parent context
     context = _get_parent_context(element)
@@ -219,18 +414,17 @@ def _extract_candidate(element: Tag) -> Optional[Dict[str, Any]]:
     # For select elements, extract options
     options: list = []
     if tag == "select":
-        for opt in element.find_all("option", limit=10):
-            opt_text = opt.get_text(strip=True)
+        for opt in islice(element.iter("option"), 10):
+            opt_text = _get_text(opt)
             if opt_text:
                 options.append(opt_text[:40])
 
-    # Get associated label text
-    label_text = _get_associated_label(element)
-    if label_text and not text:
-        text = label_text
+    # Fall back to associated label text
+    if not text:
+        text = _get_associated_label(element, attrs, label_map)
 
     # Dedup key
-    key = f"{tag}:{selector.get('value', '')}:{text[:30]}"
+    key = (tag, selector["value"], text[:30])
 
     result = {
         "tag": tag,
@@ -247,41 +441,40 @@ def _extract_candidate(element: Tag) -> Optional[Dict[str, Any]]:
     return result
 
 
-def _build_selector(element: Tag) -> Optional[Dict[str, Any]]:
-    """Build the best available selector for an element."""
+def _build_selector(tag: str, attrs: Dict[str, str], text: str) -> Optional[Dict[str, Any]]:
+    """Build the best available selector from an element's tag, attributes and text."""
     # Prefer id attribute
-    elem_id = element.get("id")
-    if elem_id and isinstance(elem_id, str) and elem_id.strip():
+    elem_id = attrs.get("id")
+    if elem_id and elem_id.strip():
         return make_selector(attribute="id", value=elem_id.strip())
 
     # Then data-testid
-    testid = element.get("data-testid")
-    if testid and isinstance(testid, str):
+    testid = attrs.get("data-testid")
+    if testid:
         return make_selector(attribute="data-testid", value=testid.strip())
 
     # Then name attribute
-    name = element.get("name")
-    if name and isinstance(name, str) and name.strip():
+    name = attrs.get("name")
+    if name and name.strip():
         return make_selector(attribute="name", value=name.strip())
 
     # Then href for links
-    if element.name == "a":
-        href = element.get("href")
-        if href and isinstance(href, str) and not href.startswith("javascript:"):
+    if tag == "a":
+        href = attrs.get("href")
+        if href and not href.startswith("javascript:"):
             return make_selector(attribute="href", value=href.strip())
 
     # Try aria-label as attribute selector
-    aria_label = element.get("aria-label")
-    if aria_label and isinstance(aria_label, str) and aria_label.strip():
+    aria_label = attrs.get("aria-label")
+    if aria_label and aria_label.strip():
         return make_selector(attribute="aria-label", value=aria_label.strip())
 
     # Try title as attribute selector
-    title = element.get("title")
-    if title and isinstance(title, str) and title.strip():
+    title = attrs.get("title")
+    if title and title.strip():
         return make_selector(attribute="title", value=title.strip())
 
     # Fall back to text content matching (tagContainsSelector)
-    text = _get_visible_text(element)
     if text:
         return make_selector(
             selector_type="tagContainsSelector",
@@ -292,29 +485,26 @@ def _build_selector(element: Tag) -> Optional[Dict[str, Any]]:
     return None
 
 
-def _get_visible_text(element: Tag) -> str:
+def _get_text(element: HtmlElement, separator: str = "") -> str:
+    """Concatenate the element's non-empty stripped text fragments."""
+    return separator.join(s for s in (t.strip() for t in element.itertext()) if s)
+
+
+def _get_visible_text(element: HtmlElement, attrs: Dict[str, str]) -> str:
     """Get visible text content of an element, trimmed."""
-    text = element.get_text(separator=" ", strip=True)
+    text = _get_text(element, " ")
     # Also check aria-label and title
     if not text:
-        text = element.get("aria-label", "") or element.get("title", "")
-        if isinstance(text, list):
-            text = " ".join(text)
-    return str(text)[:120].strip()
+        text = attrs.get("aria-label", "") or attrs.get("title", "")
+    return text[:120].strip()
 
 
-def _get_parent_context(element: Tag) -> str:
+def _get_parent_context(element: HtmlElement) -> str:
     """Get a brief description of the element's parent context."""
-    parent = element.parent
-    if not parent or not isinstance(parent, Tag):
-        return ""
-
     # Check for form, nav, header, footer, main, aside
-    for ancestor in element.parents:
-        if not isinstance(ancestor, Tag):
-            continue
-        if ancestor.name in ("form", "nav", "header", "footer", "main", "aside"):
-            return ancestor.name
+    for ancestor in element.iterancestors():
+        if ancestor.tag in ("form", "nav", "header", "footer", "main", "aside"):
+            return ancestor.tag
         role = ancestor.get("role", "")
         if role in ("navigation", "banner", "main", "form"):
             return role
@@ -322,46 +512,36 @@ def _get_parent_context(element: Tag) -> str:
     return ""
 
 
-def _get_associated_label(element: Tag) -> str:
+def _get_associated_label(
+    element: HtmlElement, attrs: Dict[str, str], label_map: Dict[str, str]
+) -> str:
     """Find label text associated with an input element."""
-    elem_id = element.get("id")
-    if elem_id:
-        # Walk up to the document root to search for label[for=id]
-        root = element
-        while root.parent and isinstance(root.parent, Tag):
-            root = root.parent
-        label = root.find("label", attrs={"for": elem_id})
-        if label:
-            return label.get_text(strip=True)[:60]
+    elem_id = attrs.get("id")
+    if elem_id and elem_id in label_map:
+        return label_map[elem_id][:60]
 
     # Check if element is inside a label
-    parent_label = element.find_parent("label")
-    if parent_label:
-        label_text = parent_label.get_text(strip=True)[:60]
-        elem_text = element.get_text(strip=True)
+    parent_label = next(element.iterancestors("label"), None)
+    if parent_label is not None:
+        label_text = _get_text(parent_label)[:60]
+        elem_text = _get_text(element)
         if label_text != elem_text:
             return label_text
 
     # Check for preceding sibling label or text
-    prev = element.find_previous_sibling("label")
-    if prev and isinstance(prev, Tag):
-        return prev.get_text(strip=True)[:60]
+    prev = next(element.itersiblings("label", preceding=True), None)
+    if prev is not None:
+        return _get_text(prev)[:60]
 
     return ""
 
 
-def _get_input_label(element: Tag) -> str:
+def _get_input_label(element: HtmlElement, label_map: Dict[str, str]) -> str:
     """Get a label for a form input."""
     # Check for associated label
     elem_id = element.get("id")
-    if elem_id:
-        # Walk up to document root to find the label
-        root = element
-        while root.parent and isinstance(root.parent, Tag):
-            root = root.parent
-        label = root.find("label", attrs={"for": elem_id})
-        if label:
-            return label.get_text(strip=True)[:40]
+    if elem_id and elem_id in label_map:
+        return label_map[elem_id][:40]
 
     # Check placeholder, name, aria-label
     for attr in ("placeholder", "name", "aria-label"):
@@ -380,18 +560,5 @@ def _candidate_priority(candidate: Dict[str, Any]) -> int:
 
 def _candidate_priority_value(tag: str, elem_type: str) -> int:
     """Priority value for sorting candidates."""
-    if tag == "input" and elem_type in ("text", "email", "password", "search", "tel", "url"):
-        return 10  # Text inputs first (form filling)
-    if tag == "textarea":
-        return 11
-    if tag == "select":
-        return 12
-    if tag == "input" and elem_type in ("submit",):
-        return 15  # Submit buttons
-    if tag == "button":
-        return 20
-    if tag == "input" and elem_type in ("checkbox", "radio"):
-        return 25
-    if tag == "a":
-        return 30  # Links last
-    return 40
+    return _PRIORITY.get((tag, elem_type)) or _PRIORITY.get((tag, ""), 40)
+
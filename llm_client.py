@@ -7,14 +7,21 @@ IWA-Task-ID header for tracking and billing.
 
 from __future__ import annotations
 
-import os
+import asyncio
+import copy
+import hashlib
 import json
-import re
-from typing import Any, Dict, List, Optional
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
+import orjson
 from loguru import logger
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
 
 _BASE_URL: str = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
@@ -29,6 +36,27 @@ try:
 except ValueError:
     _MAX_TOKENS = 256
 _TIMEOUT: float = 30.0
+try:
+    _MAX_CONCURRENCY: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+except ValueError:
+    _MAX_CONCURRENCY = 8
+
+# Bounds in-flight gateway requests across all callers (incl. batches)
+_SEM = asyncio.Semaphore(_MAX_CONCURRENCY)
+
+# Shared client so every LLM call reuses pooled keep-alive connections instead
+# of paying a fresh TCP/TLS handshake; created lazily on first use.
+_CLIENT: Optional[httpx.AsyncClient] = None
+_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=30.0)
+
+# HTTP/2 multiplexes concurrent calls over one TLS connection. It needs the
+# optional `h2` package (httpx[http2]); without it we stay on HTTP/1.1.
+# Plain-http URLs (e.g. the sandbox gateway) always use HTTP/1.1.
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
 
 
 def _is_sandbox() -> bool:
@@ -37,34 +65,265 @@ def _is_sandbox() -> bool:
     return any(h in url for h in ("sandbox-gateway", "localhost", "127.0.0.1"))
 
 
+def _get_client() -> httpx.AsyncClient:
+    """Return the shared AsyncClient, creating it on first use."""
+    global _CLIENT
+    if _CLIENT is None or _CLIENT.is_closed:
+        _CLIENT = httpx.AsyncClient(timeout=_TIMEOUT, limits=_LIMITS, http2=_HTTP2)
+    return _CLIENT
+
+
+async def warmup() -> None:
+    """Open a pooled connection to the gateway before the first real request.
+
+    Any response (even 404/405) means the TCP/TLS handshake is done; failures
+    are ignored since the first completion will simply connect as usual.
+    """
+    try:
+        await _get_client().head(_BASE_URL.rstrip("/") + "/models", timeout=2.0)
+    except Exception as exc:
+        logger.debug(f"LLM gateway warmup failed: {exc}")
+
+
+async def aclose_client() -> None:
+    """Close the shared client (call on application shutdown)."""
+    global _CLIENT
+    if _CLIENT is not None:
+        await _CLIENT.aclose()
+        _CLIENT = None
+
+
+# In-process cache of completed responses keyed by a hash of the request.
+# Steps that resend an identical prompt (retries, replays, unchanged pages with
+# identical history) return without a network round-trip. LLM_RESPONSE_CACHE=0
+# disables it.
+_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE", "1") == "1"
+_CACHE_MAX = 512
+try:
+    _CACHE_TTL: float = float(os.getenv("LLM_CACHE_TTL", "300"))
+except ValueError:
+    _CACHE_TTL = 300.0
+# (stored_at, result); stored_at is wall-clock so entries promoted from the
+# persistent layer keep their original age and one TTL governs both layers.
+_RESPONSE_CACHE: OrderedDict[str, Tuple[float, Dict[str, Any]]] = OrderedDict()
+
+
+def _cache_key(body: Dict[str, Any]) -> str:
+    payload = orjson.dumps(body, option=orjson.OPT_SORT_KEYS)
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+async def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    entry = _RESPONSE_CACHE.get(key)
+    if entry is None:
+        if not _db_enabled():
+            return None
+        row = await asyncio.to_thread(_db_get, key)
+        if row is None:
+            return None
+        stored_at, result = row
+        _memory_put(key, result, stored_at)
+        return result
+    stored_at, result = entry
+    if time.time() - stored_at > _CACHE_TTL:
+        # The persistent copy has the same timestamp, so it is stale too
+        del _RESPONSE_CACHE[key]
+        return None
+    _RESPONSE_CACHE.move_to_end(key)
+    return copy.deepcopy(result)
+
+
+async def _cache_put(key: str, result: Dict[str, Any]) -> None:
+    stored_at = time.time()
+    _memory_put(key, result, stored_at)
+    if _db_enabled():
+        await asyncio.to_thread(_db_put, key, result, stored_at)
+
+
+def _memory_put(key: str, result: Dict[str, Any], stored_at: float) -> None:
+    _RESPONSE_CACHE[key] = (stored_at, copy.deepcopy(result))
+    _RESPONSE_CACHE.move_to_end(key)
+    while len(_RESPONSE_CACHE) > _CACHE_MAX:
+        _RESPONSE_CACHE.popitem(last=False)
+
+
+# Optional persistent layer under the in-memory cache, so responses survive
+# restarts: LLM_CACHE_DB=<sqlite file>. Exact-match only and subject to the
+# same TTL as the memory cache (raise LLM_CACHE_TTL to keep entries longer).
+# Disk I/O runs in worker threads; _DB_LOCK serialises use of the connection.
+_CACHE_DB_PATH = os.getenv("LLM_CACHE_DB", "")
+_CACHE_DB_PRUNE_EVERY = 1000  # writes between expired-row sweeps
+_DB: Optional[sqlite3.Connection] = None
+_DB_FAILED = False
+_DB_WRITES = 0
+_DB_LOCK = threading.Lock()
+
+
+def _db_enabled() -> bool:
+    return bool(_CACHE_DB_PATH) and not _DB_FAILED
+
+
+def _get_db() -> Optional[sqlite3.Connection]:
+    """Open (and initialise) the cache database on first use; call under _DB_LOCK.
+
+    Returns None if disabled or if opening it failed once; a broken path is
+    not retried on every request.
+    """
+    global _DB, _DB_FAILED
+    if _DB is not None or not _db_enabled():
+        return _DB
+    try:
+        db = sqlite3.connect(_CACHE_DB_PATH, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response BLOB NOT NULL, ts REAL NOT NULL)"
+        )
+        _prune_db(db)
+    except sqlite3.Error as exc:
+        logger.warning(f"LLM cache DB disabled ({_CACHE_DB_PATH}): {exc}")
+        _DB_FAILED = True
+        return None
+    _DB = db
+    return _DB
+
+
+def _prune_db(db: sqlite3.Connection) -> None:
+    """Delete rows past the TTL (reads already ignore them)."""
+    with db:
+        db.execute("DELETE FROM responses WHERE ts <= ?", (time.time() - _CACHE_TTL,))
+
+
+def _db_get(key: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+    """Return (stored_at, result) for a live row, or None."""
+    try:
+        with _DB_LOCK:
+            db = _get_db()
+            if db is None:
+                return None
+            row = db.execute(
+                "SELECT ts, response FROM responses WHERE key = ? AND ts > ?",
+                (key, time.time() - _CACHE_TTL),
+            ).fetchone()
+    except sqlite3.Error as exc:
+        logger.warning(f"LLM cache DB read failed: {exc}")
+        return None
+    return (row[0], orjson.loads(row[1])) if row else None
+
+
+def _db_put(key: str, result: Dict[str, Any], stored_at: float) -> None:
+    global _DB_WRITES
+    try:
+        with _DB_LOCK:
+            db = _get_db()
+            if db is None:
+                return
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, ts) VALUES (?, ?, ?)",
+                    (key, orjson.dumps(result), stored_at),
+                )
+            _DB_WRITES += 1
+            if _DB_WRITES % _CACHE_DB_PRUNE_EVERY == 0:
+                _prune_db(db)
+    except sqlite3.Error as exc:
+        logger.warning(f"LLM cache DB write failed: {exc}")
+
+
+# Stream action decisions and stop reading at the first complete JSON object
+# (OPENAI_STREAM_DECISIONS=1). Off by default: the gateway must support SSE.
+_STREAM_DECISIONS = os.getenv("OPENAI_STREAM_DECISIONS", "0") == "1"
+
+# Models that answered a response_format request with 400. Later calls to
+# them omit response_format up front instead of paying a failed round-trip.
+_MODEL_SUPPORTS_JSON: Dict[str, bool] = {}
+
+
+# Transient failures: 2 attempts in total, backing off 0.5s (capped at 3s)
+_RETRY_ATTEMPTS = 2
+_RETRY_BASE_DELAY = 0.5
+_RETRY_MAX_DELAY = 3.0
+
+
 class _TransientError(Exception):
     """Wrapper for transient errors that should be retried."""
     pass
 
 
-@retry(
-    stop=stop_after_attempt(2),
-    wait=wait_exponential(multiplier=0.5, min=0.5, max=3),
-    retry=retry_if_exception_type((_TransientError,)),
-    reraise=True,
-)
+async def _post_once(
+    url: str,
+    headers: Dict[str, str],
+    body: Dict[str, Any],
+) -> Dict[str, Any]:
+    """Make one HTTP request; network errors and 5xx raise _TransientError."""
+    try:
+        async with _SEM:
+            resp = await _get_client().post(url, headers=headers, content=orjson.dumps(body))
+    except httpx.RequestError as exc:
+        raise _TransientError(str(exc)) from exc
+
+    if resp.status_code >= 500:
+        raise _TransientError(f"Server error {resp.status_code}: {resp.text[:200]}")
+
+    resp.raise_for_status()
+    return orjson.loads(resp.content)
+
+
 async def _do_request(
     url: str,
     headers: Dict[str, str],
     body: Dict[str, Any],
 ) -> Dict[str, Any]:
-    """Make the HTTP request with retry logic for transient failures."""
-    async with httpx.AsyncClient(timeout=_TIMEOUT) as client:
+    """Make the HTTP request with retry logic for transient failures.
+
+    A plain loop rather than a retry decorator: the first attempt (which is
+    nearly always the only one) carries no retry bookkeeping.
+    """
+    for attempt in range(_RETRY_ATTEMPTS - 1):
         try:
-            resp = await client.post(url, headers=headers, json=body)
-        except httpx.RequestError as exc:
-            raise _TransientError(str(exc)) from exc
+            return await _post_once(url, headers, body)
+        except _TransientError:
+            await asyncio.sleep(min(_RETRY_BASE_DELAY * 2 ** attempt, _RETRY_MAX_DELAY))
+    # Last attempt: let _TransientError propagate
+    return await _post_once(url, headers, body)
+
 
-        if resp.status_code >= 500:
-            raise _TransientError(f"Server error {resp.status_code}: {resp.text[:200]}")
+_COMPLETIONS_URL = f"{_BASE_URL.rstrip('/')}/chat/completions"
 
-        resp.raise_for_status()
-        return resp.json()
+
+@lru_cache(maxsize=256)
+def _headers_for(task_id: str) -> Dict[str, str]:
+    """Request headers for a task, built once and shared by all its steps.
+
+    httpx copies headers into each request, so the cached dict is never mutated.
+    """
+    return {
+        "Authorization": f"Bearer {_API_KEY}",
+        "Content-Type": "application/json",
+        "IWA-Task-ID": task_id,
+    }
+
+
+def _build_request(
+    messages: List[Dict[str, str]],
+    task_id: str,
+    model: str,
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    response_format: Optional[Dict[str, str]],
+) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
+    """Return (url, headers, body) for a chat/completions call, applying defaults."""
+    body: Dict[str, Any] = {
+        "model": model,
+        "messages": messages,
+        "temperature": temperature if temperature is not None else _TEMPERATURE,
+        "max_tokens": max_tokens if max_tokens is not None else _MAX_TOKENS,
+    }
+    if response_format and _MODEL_SUPPORTS_JSON.get(model, True):
+        body["response_format"] = response_format
+
+    return _COMPLETIONS_URL, _headers_for(str(task_id)), body
 
 
 async def chat_completion(
@@ -82,97 +341,190 @@ async def chat_completion(
       - usage: dict (token counts)
     """
     model = model or _MODEL
-    temperature = temperature if temperature is not None else _TEMPERATURE
-    max_tokens = max_tokens if max_tokens is not None else _MAX_TOKENS
+    url, headers, body = _build_request(
+        messages, task_id, model, temperature, max_tokens, response_format
+    )
+
+    cache_key = _cache_key(body) if _CACHE_ENABLED else ""
+    if cache_key:
+        cached = await _cache_get(cache_key)
+        if cached is not None:
+            return cached
+
+    # At most two passes: a 400 with response_format set is retried once
+    # without it. The model is only marked as lacking JSON mode when the
+    # error names the field, so unrelated 400s (e.g. context length) don't
+    # disable it for later tasks.
+    while True:
+        try:
+            data = await _do_request(url, headers, body)
+            break
+        except _TransientError as exc:
+            logger.error(f"LLM transient error (after retries): {exc}")
+            raise
+        except httpx.HTTPStatusError as exc:
+            status = exc.response.status_code
+            error_text = exc.response.text[:500]
+            logger.error(f"LLM API error ({status}): {error_text}")
+            if status == 400 and "response_format" in body:
+                if "response_format" in error_text or "json_object" in error_text:
+                    logger.warning(f"Retrying without response_format (disabled for {model})")
+                    _MODEL_SUPPORTS_JSON[model] = False
+                else:
+                    logger.warning("Retrying without response_format")
+                body.pop("response_format")
+                continue
+            raise
+        except httpx.RequestError as exc:
+            logger.error(f"LLM request failed: {exc}")
+            raise
 
-    headers = {
-        "Authorization": f"Bearer {_API_KEY}",
-        "Content-Type": "application/json",
-        "IWA-Task-ID": str(task_id),
+    result = _parse_envelope(data, model)
+
+    # Truncated answers are not worth replaying
+    if cache_key and result["finish_reason"] != "length":
+        await _cache_put(cache_key, result)
+
+    return result
+
+
+def _parse_envelope(data: Dict[str, Any], model: str) -> Dict[str, Any]:
+    """Flatten a chat/completions response into the dict chat_completion returns.
+
+    Tolerates an empty ``choices`` list and null fields, which some gateways
+    send instead of omitting them.
+    """
+    choices = data.get("choices")
+    choice = choices[0] if choices else {}
+    message = choice.get("message") or {}
+    return {
+        "content": message.get("content") or "",
+        "usage": data.get("usage") or {},
+        "model": data.get("model") or model,
+        "finish_reason": choice.get("finish_reason") or "",
     }
 
-    body: Dict[str, Any] = {
+
+async def chat_completion_stream(
+    messages: List[Dict[str, str]],
+    task_id: str,
+    model: Optional[str] = None,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    response_format: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """Stream a chat completion, stopping once a complete JSON object has arrived.
+
+    For callers that only need the first JSON object of the reply: the stream
+    is closed as soon as the text from the first '{' decodes, instead of
+    waiting for the server to finish. Returns the same shape as
+    chat_completion(); usage is not reported on streamed responses. No retries
+    or response_format fallback here; callers fall back to chat_completion().
+    """
+    model = model or _MODEL
+    url, headers, body = _build_request(
+        messages, task_id, model, temperature, max_tokens, response_format
+    )
+    body["stream"] = True
+
+    parts: List[str] = []
+    finish_reason = ""
+    async with _SEM:
+        async with _get_client().stream(
+            "POST", url, headers=headers, content=orjson.dumps(body)
+        ) as resp:
+            if resp.status_code >= 400:
+                await resp.aread()
+                resp.raise_for_status()
+
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choice = (orjson.loads(data).get("choices") or [{}])[0]
+                finish_reason = choice.get("finish_reason") or finish_reason
+                delta = (choice.get("delta") or {}).get("content")
+                if not delta:
+                    continue
+                parts.append(delta)
+                if "}" in delta and _first_json_object_complete("".join(parts)):
+                    finish_reason = finish_reason or "stop"
+                    break
+
+    return {
+        "content": "".join(parts),
+        "usage": {},
         "model": model,
-        "messages": messages,
-        "temperature": temperature,
-        "max_tokens": max_tokens,
+        "finish_reason": finish_reason,
     }
-    if response_format:
-        body["response_format"] = response_format
 
-    url = f"{_BASE_URL.rstrip('/')}/chat/completions"
 
+def _first_json_object_complete(content: str) -> bool:
+    """True once the text starting at the first '{' decodes as a JSON object.
+
+    Only the first '{' is tried: later ones may open nested objects of a
+    still-incomplete outer object.
+    """
+    start = content.find("{")
+    if start == -1:
+        return False
     try:
-        data = await _do_request(url, headers, body)
-    except _TransientError as exc:
-        logger.error(f"LLM transient error (after retries): {exc}")
-        raise
-    except httpx.HTTPStatusError as exc:
-        error_text = exc.response.text[:500] if exc.response else str(exc)
-        logger.error(f"LLM API error ({exc.response.status_code}): {error_text}")
-
-        # Retry without response_format if unsupported (400 error)
-        if response_format and exc.response and exc.response.status_code == 400:
-            logger.warning("Retrying without response_format")
-            body.pop("response_format", None)
-            try:
-                data = await _do_request(url, headers, body)
-            except Exception:
-                raise
-        else:
-            raise
-    except httpx.RequestError as exc:
-        logger.error(f"LLM request failed: {exc}")
-        raise
+        result, _ = _JSON_DECODER.raw_decode(content, start)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(result, dict)
 
-    choice = data.get("choices", [{}])[0]
-    message = choice.get("message", {})
 
-    return {
-        "content": message.get("content", ""),
-        "usage": data.get("usage", {}),
-        "model": data.get("model", model),
-        "finish_reason": choice.get("finish_reason", ""),
-    }
+async def chat_completion_batch(
+    batch: List[Dict[str, Any]],
+    task_id: str,
+) -> List[Any]:
+    """Run several chat completions concurrently.
+
+    Each item holds chat_completion() keyword arguments (messages, model, ...).
+    Results keep the input order; a failed call yields its exception instead
+    of a result. Concurrency is bounded by OPENAI_MAX_CONCURRENCY.
+    """
+    return await asyncio.gather(
+        *(chat_completion(task_id=task_id, **kwargs) for kwargs in batch),
+        return_exceptions=True,
+    )
+
+
+# stdlib decoder for raw_decode(), which parses one JSON value at an offset
+# and ignores whatever follows it (orjson has no equivalent)
+_JSON_DECODER = json.JSONDecoder()
 
 
 def _extract_json(content: str) -> Optional[Dict[str, Any]]:
     """Extract a JSON object from LLM content, handling various formats."""
     content = content.strip()
-    if not content:
+    # No brace means no JSON object anywhere; skip all parse attempts
+    if "{" not in content:
         return None
 
     # Try direct parse first
     try:
-        result = json.loads(content)
+        result = orjson.loads(content)
         if isinstance(result, dict):
             return result
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         pass
 
-    # Try to extract from markdown code blocks
-    if "```" in content:
-        for block in content.split("```"):
-            block = block.strip()
-            if block.startswith("json"):
-                block = block[4:].strip()
-            if block.startswith("{"):
-                try:
-                    result = json.loads(block)
-                    if isinstance(result, dict):
-                        return result
-                except json.JSONDecodeError:
-                    continue
-
-    # Try to find a JSON object in the content using regex
-    match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content)
-    if match:
+    # Decode the first object that starts at some '{'. This covers prose
+    # around the JSON ("Sure! {...} done.") and markdown code fences alike.
+    start = content.find("{")
+    while start != -1:
         try:
-            result = json.loads(match.group())
-            if isinstance(result, dict):
-                return result
+            result, _ = _JSON_DECODER.raw_decode(content, start)
         except json.JSONDecodeError:
             pass
+        else:
+            if isinstance(result, dict):
+                return result
+        start = content.find("{", start + 1)
 
     return None
 
@@ -186,16 +538,29 @@ async def get_action_decision(
 
     Returns the parsed dict or an empty dict on failure.
     """
-    try:
-        result = await chat_completion(
-            messages=messages,
-            task_id=task_id,
-            model=model,
-            response_format={"type": "json_object"},
-        )
-    except Exception as exc:
-        logger.error(f"LLM call failed: {exc}")
-        return {}
+    result: Optional[Dict[str, Any]] = None
+    if _STREAM_DECISIONS:
+        try:
+            result = await chat_completion_stream(
+                messages=messages,
+                task_id=task_id,
+                model=model,
+                response_format={"type": "json_object"},
+            )
+        except Exception as exc:
+            logger.warning(f"Streaming LLM call failed, retrying without streaming: {exc}")
+
+    if result is None:
+        try:
+            result = await chat_completion(
+                messages=messages,
+                task_id=task_id,
+                model=model,
+                response_format={"type": "json_object"},
+            )
+        except Exception as exc:
+            logger.error(f"LLM call failed: {exc}")
+            return {}
 
     content = result.get("content", "").strip()
     if not content:
@@ -207,3 +572,73 @@ async def get_action_decision(
         return {}
 
     return parsed
+
+
+_BATCH_INSTRUCTIONS = (
+    "You are given {n} independent steps, separated by '---'. Decide each step "
+    "on its own and respond with ONLY a JSON object of the form "
+    '{{"decisions": [<action for step 1>, <action for step 2>, ...]}} '
+    "containing exactly {n} action objects, in step order."
+)
+
+
+async def get_action_decisions_batched(
+    message_lists: List[List[Dict[str, str]]],
+    task_id: str,
+    model: Optional[str] = None,
+    k_per_prompt: int = 4,
+) -> List[Dict[str, Any]]:
+    """Decide several independent steps with fewer LLM round-trips.
+
+    Each item of message_lists is what get_action_decision() would take; all
+    items are expected to share the same system message. Steps are packed
+    k_per_prompt at a time into one request and the chunks run concurrently.
+    Returns one decision per input, in order ({} where a decision is missing).
+    """
+    k = max(k_per_prompt, 1)
+    chunks = [message_lists[i:i + k] for i in range(0, len(message_lists), k)]
+    results = await asyncio.gather(
+        *(_get_chunk_decisions(chunk, task_id, model) for chunk in chunks)
+    )
+    return [decision for chunk_result in results for decision in chunk_result]
+
+
+async def _get_chunk_decisions(
+    chunk: List[List[Dict[str, str]]],
+    task_id: str,
+    model: Optional[str],
+) -> List[Dict[str, Any]]:
+    """Decide one chunk of steps in a single request."""
+    if len(chunk) == 1:
+        return [await get_action_decision(chunk[0], task_id=task_id, model=model)]
+
+    n = len(chunk)
+    first = chunk[0]
+    system = [first[0]] if first and first[0].get("role") == "system" else []
+    steps = "\n---\n".join(
+        f"Step {i}:\n" + "\n".join(m["content"] for m in messages if m.get("role") != "system")
+        for i, messages in enumerate(chunk, 1)
+    )
+    user = {"role": "user", "content": f"{_BATCH_INSTRUCTIONS.format(n=n)}\n\n{steps}"}
+
+    try:
+        result = await chat_completion(
+            messages=system + [user],
+            task_id=task_id,
+            model=model,
+            max_tokens=_MAX_TOKENS * n,
+            response_format={"type": "json_object"},
+        )
+    except Exception as exc:
+        logger.error(f"Batched LLM call failed: {exc}")
+        return [{} for _ in chunk]
+
+    content = result.get("content", "").strip()
+    parsed = _extract_json(content)
+    decisions = parsed.get("decisions") if parsed else None
+    if not isinstance(decisions, list):
+        logger.warning(f"Failed to parse batched LLM JSON: {content[:200]}")
+        return [{} for _ in chunk]
+
+    decisions = [d if isinstance(d, dict) else {} for d in decisions[:n]]
+    return decisions + [{} for _ in range(n - len(decisions))]
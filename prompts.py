@@ -1,4 +1,19 @@
-"""System prompts and prompt templates for the web agent."""
+"""System prompts and prompt templates for the web agent.
+
+Provider prompt caching (e.g. OpenAI automatic prefix caching) only applies
+to a byte-identical leading prefix. SYSTEM_PROMPT is therefore a constant
+that is never formatted per request, and the user message lists its
+sections in a fixed order, most stable first (TASK ... HISTORY).
+"""
+
+import os
+
+# Character budgets (~4 chars per token) for the variable-size prompt sections
+try:
+    _MAX_ELEMENTS_CHARS = int(os.getenv("MAX_ELEMENTS_CHARS", "6000"))
+except ValueError:
+    _MAX_ELEMENTS_CHARS = 6000
+_MAX_SUMMARY_CHARS = 1500
 
 SYSTEM_PROMPT = """\
 You are a web agent that completes tasks on websites by choosing actions step-by-step.
@@ -32,6 +47,30 @@ STRATEGY:
 - Pay attention to field labels and placeholders to choose the right element.\
 """
 
+# Shared by every request so the leading message is the same object (and the
+# same bytes) on every call; LLM clients only read it.
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+
+def build_messages(
+    task: str,
+    url: str,
+    page_summary: str,
+    candidates_text: str,
+    history: list,
+    step_index: int,
+) -> list:
+    """Build the [system, user] message list for one agent step."""
+    user_prompt = build_user_prompt(
+        task=task,
+        url=url,
+        page_summary=page_summary,
+        candidates_text=candidates_text,
+        history=history,
+        step_index=step_index,
+    )
+    return [SYSTEM_MESSAGE, {"role": "user", "content": user_prompt}]
+
 
 def build_user_prompt(
     task: str,
@@ -41,27 +80,28 @@ def build_user_prompt(
     history: list,
     step_index: int,
 ) -> str:
-    """Build the user message for the LLM."""
-    parts = [f"TASK: {task}", f"URL: {url}"]
+    """Build the user message for the LLM.
 
-    if page_summary:
-        parts.append(f"PAGE: {page_summary}")
+    Sections always appear in the same order; an empty page summary is
+    rendered as "(none)" rather than dropped so the layout never shifts.
+    """
+    page_summary = _truncate_lines(page_summary, _MAX_SUMMARY_CHARS)
+    candidates_text = _truncate_lines(candidates_text, _MAX_ELEMENTS_CHARS)
 
-    parts.append(f"ELEMENTS:\n{candidates_text}")
+    parts = [
+        f"TASK: {task}",
+        f"URL: {url}",
+        f"PAGE: {page_summary or '(none)'}",
+        f"ELEMENTS:\n{candidates_text}",
+    ]
 
     if history:
         parts.append("HISTORY:")
         recent = history[-5:]
-        for i, h in enumerate(recent):
-            action_type = h.get("type", h.get("action", "?"))
-            text = h.get("text", "")
-            sel = h.get("selector", {})
-            desc = action_type
-            if text:
-                desc += f' "{text[:40]}"'
-            if sel and sel.get("value"):
-                desc += f' [{sel["value"][:30]}]'
-            parts.append(f"  {step_index - len(recent) + i}: {desc}")
+        first_step = step_index - len(recent)
+        parts.extend(
+            f"  {first_step + i}: {_format_history_entry(h)}" for i, h in enumerate(recent)
+        )
 
         if _detect_loop(history):
             parts.append("WARNING: Loop detected. Try a COMPLETELY DIFFERENT action.")
@@ -69,13 +109,33 @@ def build_user_prompt(
     return "\n".join(parts)
 
 
+def _truncate_lines(text: str, limit: int) -> str:
+    """Cap text at `limit` chars, cutting at a line break so no entry is split."""
+    if len(text) <= limit:
+        return text
+    cut = text.rfind("\n", 0, limit)
+    return text[:cut if cut > 0 else limit]
+
+
+def _format_history_entry(h: dict) -> str:
+    """One-line description of a past action: type, typed text, selector value."""
+    desc = [str(h.get("type", h.get("action", "?")))]
+    text = h.get("text", "")
+    if text:
+        desc.append(f'"{text[:40]}"')
+    sel = h.get("selector", {})
+    if sel and sel.get("value"):
+        desc.append(f'[{sel["value"][:30]}]')
+    return " ".join(desc)
+
+
 def _detect_loop(history: list) -> bool:
     """Check if the last few actions are repetitive."""
     if len(history) < 3:
         return False
-    recent = history[-3:]
-    sigs = []
-    for h in recent:
-        sig = f"{h.get('type','')}{h.get('action','')}{h.get('candidate_id','')}{h.get('text','')}"
-        sigs.append(sig)
-    return len(set(sigs)) == 1
+    a, b, c = (_action_signature(h) for h in history[-3:])
+    return a == b == c
+
+
+def _action_signature(h: dict) -> tuple:
+    return (h.get("type", ""), h.get("action", ""), h.get("candidate_id", ""), h.get("text", ""))